@@ -2,211 +2,408 @@
 Management command to ingest customer and loan data from Excel files.
 """
 
+import django
 import pandas as pd
 from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
 from django.utils import timezone
+from django_bulk_load import bulk_insert_models
+from python_calamine import CalamineWorkbook
 from core.models import Customer, Loan
-from datetime import datetime
+from core.utils import calculate_emi_vec, round_to_nearest_lakh
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import chain, islice
 import os
 
 
+def _convert_cell(value):
+    # calamine gives '' for empty cells and floats for every number,
+    # so tidy them up the same way pandas does when it reads the file
+    if value == '':
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _read_xlsx_chunks(path, size=10_000):
+    """
+    Read the first sheet of an Excel file and return its header plus an iterator
+    over batches of at most `size` raw rows, so memory stays bounded by the chunk
+    size instead of the file size. Cells are left as calamine gives them; turning
+    them into DataFrames happens in _rows_to_frame, inside the worker pool.
+    """
+    sheet = CalamineWorkbook.from_path(path).get_sheet_by_index(0)
+    rows = sheet.iter_rows()
+
+    header = next(rows, None)
+    if header is None:
+        return [], iter(())
+    columns = [str(name) for name in header]
+    return columns, iter(lambda: list(islice(rows, size)), [])
+
+
+def _rows_to_frame(columns, rows, column_mapping, dtype):
+    """
+    Build a DataFrame from raw Excel rows and rename its columns to model fields.
+    Only text columns are typed here; numbers are coerced by the cleaning functions.
+    """
+    batch = [[_convert_cell(value) for value in row] for row in rows]
+    df = pd.DataFrame(batch, columns=columns)
+    df = df.astype({col: t for col, t in dtype.items() if col in df.columns})
+    return df.rename(columns=column_mapping)
+
+
+def _parallel_map(func, items, workers):
+    """
+    Like map(), but runs `func` in a process pool when workers > 1 and there is
+    more than one item. Results come back in order and only a few items are in
+    flight at once, so memory stays bounded.
+    """
+    items = iter(items)
+    head = list(islice(items, 2))
+    if workers <= 1 or len(head) < 2:
+        yield from map(func, chain(head, items))
+        return
+
+    # workers never touch the database, so don't let them inherit our connection;
+    # each one sets up Django itself, so this also works where processes are spawned
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+        pending = deque()
+        for item in chain(head, items):
+            pending.append(pool.submit(func, item))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# Excel columns have spaces, so we map them to our database column names
+_CUSTOMER_COLUMNS = {
+    'Customer ID': 'customer_id',
+    'First Name': 'first_name',
+    'Last Name': 'last_name',
+    'Phone Number': 'phone_number',
+    'Age': 'age',
+    'Monthly Salary': 'monthly_salary',
+    'Approved Limit': 'approved_limit',
+}
+
+# only the text columns get a dtype up front; numbers are coerced while
+# cleaning, so a malformed cell skips its row instead of failing the file
+_CUSTOMER_DTYPE = {
+    'First Name': 'string',
+    'Last Name': 'string',
+    'Phone Number': 'string',
+}
+
+_LOAN_COLUMNS = {
+    'Customer ID': 'customer_id',
+    'Loan ID': 'loan_id',
+    'Loan Amount': 'loan_amount',
+    'Tenure': 'tenure',
+    'Interest Rate': 'interest_rate',
+    'Monthly payment': 'monthly_repayment',
+    'EMIs paid on Time': 'emis_paid_on_time',
+    'Date of Approval': 'start_date',
+    'End Date': 'end_date',
+}
+
+
+# fill-ins for customer columns the Excel file doesn't have
+_CUSTOMER_DEFAULTS = {
+    'first_name': 'Unknown',
+    'last_name': '',
+    'phone_number': None,
+    'age': 0,
+    'monthly_salary': 0.0,
+    'approved_limit': None,
+    'current_debt': 0.0,
+}
+
+
+def _clean_customer_chunk(df):
+    """
+    Validate and convert one chunk of customer rows. Doesn't touch the database,
+    so it can run in a worker process. Returns the cleaned rows and skip counts.
+    """
+    for col, default in _CUSTOMER_DEFAULTS.items():
+        if col not in df.columns:
+            df[col] = default
+
+    # validate the whole column at once instead of row by row;
+    # anything that can't be parsed as a number counts as null
+    customer_id = pd.to_numeric(df['customer_id'], errors='coerce')
+    m_null = customer_id.isna()
+    m_zero = customer_id.eq(0)
+    counts = {'rows': len(df), 'null': int(m_null.sum()), 'zero': int(m_zero.sum())}
+
+    df = df.loc[~(m_null | m_zero)].copy()
+    df['customer_id'] = customer_id.loc[df.index].astype('int64')
+
+    for col in ('age', 'monthly_salary', 'current_debt'):
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+
+    # customers without an approved limit get the usual 36 x salary,
+    # rounded to the nearest lakh, for the whole column at once
+    approved_limit = pd.to_numeric(df['approved_limit'], errors='coerce')
+    df['approved_limit'] = approved_limit.where(
+        approved_limit.notna(),
+        round_to_nearest_lakh(df['monthly_salary'].to_numpy() * 36),
+    )
+    df = df.astype({'age': 'int64'})
+    df = df.fillna({'first_name': 'Unknown', 'last_name': ''})
+    df['first_name'] = df['first_name'].astype(str).str.strip()
+    df['last_name'] = df['last_name'].astype(str).str.strip()
+    df['phone_number'] = df['phone_number'].astype('string').str.strip()
+
+    return df[['customer_id', *_CUSTOMER_DEFAULTS]], counts
+
+
+def _clean_loan_chunk(df):
+    """
+    Validate and convert one chunk of loan rows. Doesn't touch the database,
+    so it can run in a worker process. Returns the cleaned rows and the row count read.
+    """
+    rows = len(df)
+
+    # drop rows with a missing or zero loan/customer ID with one mask
+    loan_id = pd.to_numeric(df['loan_id'], errors='coerce')
+    customer_id = pd.to_numeric(df['customer_id'], errors='coerce')
+    valid = loan_id.notna() & customer_id.notna() & loan_id.ne(0) & customer_id.ne(0)
+
+    df = df.loc[valid].copy()
+    df['loan_id'] = loan_id.loc[valid].astype('int64')
+    df['customer_id'] = customer_id.loc[valid].astype('int64')
+
+    # parse the date columns in one pass each; text dates use the same
+    # YYYY-MM-DD layout as before, so skip pandas' format guessing
+    for col in ('start_date', 'end_date'):
+        if col not in df.columns:
+            df[col] = None
+        df[col] = pd.to_datetime(df[col], errors='coerce', format='ISO8601').dt.date
+    df['start_date'] = df['start_date'].fillna(timezone.now().date())
+
+    for col in ('loan_amount', 'tenure', 'interest_rate', 'emis_paid_on_time'):
+        if col not in df.columns:
+            df[col] = 0
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+    df = df.astype({'tenure': 'int64', 'emis_paid_on_time': 'int64'})
+
+    # blank monthly payments fall back to an 'emi' column if the file has one
+    # (a payment of 0 is kept as 0), and whatever is still missing gets worked
+    # out from the loan terms, all in one array call
+    if 'monthly_repayment' not in df.columns:
+        df['monthly_repayment'] = None
+    df['monthly_repayment'] = pd.to_numeric(df['monthly_repayment'], errors='coerce')
+    if 'emi' in df.columns:
+        df['monthly_repayment'] = df['monthly_repayment'].fillna(pd.to_numeric(df['emi'], errors='coerce'))
+    no_payment = df['monthly_repayment'].isna() & (df['tenure'] > 0)
+    if no_payment.any():
+        df.loc[no_payment, 'monthly_repayment'] = calculate_emi_vec(
+            df.loc[no_payment, 'loan_amount'],
+            df.loc[no_payment, 'interest_rate'],
+            df.loc[no_payment, 'tenure'],
+        )
+    df['monthly_repayment'] = df['monthly_repayment'].fillna(0)
+
+    return df, rows
+
+
+def _parse_validate_customer_chunk(columns, rows):
+    """
+    Turn one batch of raw customer rows into cleaned rows. Runs in a worker process.
+    """
+    return _clean_customer_chunk(_rows_to_frame(columns, rows, _CUSTOMER_COLUMNS, _CUSTOMER_DTYPE))
+
+
+def _parse_validate_loan_chunk(columns, rows):
+    """
+    Turn one batch of raw loan rows into cleaned rows. Runs in a worker process.
+    """
+    return _clean_loan_chunk(_rows_to_frame(columns, rows, _LOAN_COLUMNS, {}))
+
+
 class Command(BaseCommand):
     help = 'Import customer and loan data from Excel files'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of processes used to parse and validate chunks (1 = no pool)',
+        )
+
     def handle(self, *args, **options):
         # run both imports
+        self.workers = options['workers']
         self.ingest_customers()
         self.ingest_loans()
+        self.reset_sequences()
         self.stdout.write(self.style.SUCCESS('Data ingestion completed successfully.'))
 
+    def bulk_insert(self, model, objs):
+        # on Postgres we stream the rows with COPY, which is a lot faster than
+        # INSERT statements for big files; other databases use bulk_create.
+        # each chunk commits once, so a bad chunk doesn't undo the rest of the file
+        if not objs:
+            return
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                bulk_insert_models(objs, ignore_conflicts=True)
+            else:
+                model.objects.bulk_create(objs, batch_size=5000, ignore_conflicts=True)
+
+    def reset_sequences(self):
+        # rows were loaded with the IDs from the files, so move the ID
+        # sequences past them before new customers and loans are created
+        statements = connection.ops.sequence_reset_sql(no_style(), [Customer, Loan])
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
     def ingest_customers(self):
         # read customers from Excel file and save to database
         # Look for Excel file in project root (/app/)
         excel_path = os.path.join('/app', 'customer_data.xlsx')
-        
+
         if not os.path.exists(excel_path):
             self.stdout.write(self.style.WARNING(f'Customer data file not found at {excel_path}'))
             return
-        
+
         try:
-            df = pd.read_excel(excel_path)
-            
-            # Excel columns have spaces, so we map them to our database column names
-            column_mapping = {
-                'Customer ID': 'customer_id',
-                'First Name': 'first_name',
-                'Last Name': 'last_name',
-                'Phone Number': 'phone_number',
-                'Age': 'age',
-                'Monthly Salary': 'monthly_salary',
-                'Approved Limit': 'approved_limit',
-            }
-            
-            # rename the Excel columns
-            df = df.rename(columns=column_mapping)
-            
-            # if current_debt is missing, set it to 0
-            if 'current_debt' not in df.columns:
-                df['current_debt'] = 0.0
-            
-            self.stdout.write(f"Mapped columns: {list(df.columns)}")
-            
-            skipped = 0
+            total_rows = 0
             created = 0
-            skipped_reasons = {'null': 0, 'zero': 0, 'duplicate': 0}
-            
-            for idx, row in df.iterrows():
-                # Skip if customer_id is missing, 0, or null
-                customer_id = row.get('customer_id')
-                
-                # Debug: show first few rows
-                if idx < 3:
-                    self.stdout.write(f"Row {idx}: customer_id={customer_id} (type: {type(customer_id).__name__})")
-                
-                if pd.isna(customer_id):
-                    skipped_reasons['null'] += 1
-                    skipped += 1
-                    continue
-                
-                # Handle string/float conversions
-                try:
-                    customer_id = int(float(customer_id))
-                except (ValueError, TypeError):
-                    skipped_reasons['null'] += 1
-                    skipped += 1
-                    continue
-                
-                if customer_id == 0 or customer_id == '':
-                    skipped_reasons['zero'] += 1
-                    skipped += 1
-                    continue
-                
-                # Check if customer already exists
-                if Customer.objects.filter(customer_id=customer_id).exists():
-                    skipped_reasons['duplicate'] += 1
-                    skipped += 1
-                    continue
-                
-                try:
-                    customer = Customer.objects.create(
-                        customer_id=customer_id,
-                        first_name=str(row.get('first_name', 'Unknown')).strip(),
-                        last_name=str(row.get('last_name', '')).strip(),
-                        phone_number=str(row.get('phone_number', '')).strip(),
-                        age=int(row.get('age', 0)) if pd.notna(row.get('age')) else 0,
-                        monthly_salary=float(row.get('monthly_salary', 0)) if pd.notna(row.get('monthly_salary')) else 0,
-                        approved_limit=float(row.get('approved_limit', 0)) if pd.notna(row.get('approved_limit')) else 0,
-                        current_debt=float(row.get('current_debt', 0)) if pd.notna(row.get('current_debt')) else 0,
-                    )
-                    created += 1
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f"Error creating customer {customer_id}: {str(e)}"))
-                    skipped += 1
-            
-            self.stdout.write(self.style.SUCCESS(f'Created {created} customers, skipped {skipped} (null: {skipped_reasons["null"]}, zero: {skipped_reasons["zero"]}, duplicate: {skipped_reasons["duplicate"]})'))
-        
+            skipped_reasons = {'null': 0, 'zero': 0, 'duplicate': 0, 'phone': 0}
+
+            # load the IDs and phone numbers we already have once, then check rows against the sets
+            existing = set(Customer.objects.values_list('customer_id', flat=True))
+            phones = set(Customer.objects.exclude(phone_number=None).values_list('phone_number', flat=True))
+
+            # rows are read here, parsed and validated in the worker pool, written back here
+            columns, chunks = _read_xlsx_chunks(excel_path)
+            parse = partial(_parse_validate_customer_chunk, columns)
+            for i, (df, counts) in enumerate(_parallel_map(parse, chunks, self.workers)):
+                if i == 0:
+                    self.stdout.write(f"Mapped columns: {list(df.columns)}")
+
+                total_rows += counts['rows']
+                skipped_reasons['null'] += counts['null']
+                skipped_reasons['zero'] += counts['zero']
+                created += self.write_customer_chunk(df, existing, phones, skipped_reasons)
+
+            skipped = total_rows - created
+
+            self.stdout.write(self.style.SUCCESS(f'Created {created} customers, skipped {skipped} (null: {skipped_reasons["null"]}, zero: {skipped_reasons["zero"]}, duplicate: {skipped_reasons["duplicate"]}, phone: {skipped_reasons["phone"]})'))
+
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'Error ingesting customers: {str(e)}'))
 
+    def write_customer_chunk(self, df, existing, phones, skipped_reasons):
+        """
+        Insert one cleaned chunk of customers. Returns how many were created.
+        """
+        is_duplicate = df['customer_id'].isin(existing) | df['customer_id'].duplicated()
+        skipped_reasons['duplicate'] += int(is_duplicate.sum())
+        df = df[~is_duplicate]
+
+        # phone numbers are unique too; the insert ignores conflicts, so catch
+        # repeats here or they'd be dropped while still counted as created
+        phone = df['phone_number']
+        phone_taken = phone.notna() & (phone.isin(phones) | phone.duplicated())
+        for row in df[phone_taken].itertuples(index=False):
+            self.stdout.write(self.style.WARNING(f"Customer {row.customer_id} skipped: phone number {row.phone_number} already in use"))
+        skipped_reasons['phone'] += int(phone_taken.sum())
+        df = df[~phone_taken]
+
+        customers = [
+            Customer(
+                customer_id=row.customer_id,
+                first_name=row.first_name,
+                last_name=row.last_name,
+                phone_number=row.phone_number if pd.notna(row.phone_number) else None,
+                age=row.age,
+                monthly_salary=row.monthly_salary,
+                approved_limit=row.approved_limit,
+                current_debt=row.current_debt,
+            )
+            for row in df.itertuples(index=False)
+        ]
+
+        self.bulk_insert(Customer, customers)
+        existing.update(df['customer_id'].tolist())
+        phones.update(df['phone_number'].dropna().tolist())
+        return len(customers)
+
     def ingest_loans(self):
         """
         Ingest loan data from loan_data.xlsx
         """
         # Look for Excel file in project root (/app/)
         excel_path = os.path.join('/app', 'loan_data.xlsx')
-        
+
         if not os.path.exists(excel_path):
             self.stdout.write(self.style.WARNING(f'Loan data file not found at {excel_path}'))
             return
-        
+
         try:
-            df = pd.read_excel(excel_path)
-            
-            # Map Excel columns to model fields
-            column_mapping = {
-                'Customer ID': 'customer_id',
-                'Loan ID': 'loan_id',
-                'Loan Amount': 'loan_amount',
-                'Tenure': 'tenure',
-                'Interest Rate': 'interest_rate',
-                'Monthly payment': 'monthly_repayment',
-                'EMIs paid on Time': 'emis_paid_on_time',
-                'Date of Approval': 'start_date',
-                'End Date': 'end_date',
-            }
-            
-            # Rename columns
-            df = df.rename(columns=column_mapping)
-            
-            self.stdout.write(f"Mapped loan columns: {list(df.columns)}")
-            
-            skipped = 0
+            total_rows = 0
             created = 0
-            
-            for _, row in df.iterrows():
-                # Skip if loan_id is missing, 0, or null
-                loan_id = row.get('loan_id')
-                if pd.isna(loan_id) or loan_id == 0 or loan_id == '':
-                    skipped += 1
-                    continue
-                
-                loan_id = int(loan_id)
-                
-                # Skip if customer_id is missing, 0, or null
-                customer_id = row.get('customer_id')
-                if pd.isna(customer_id) or customer_id == 0 or customer_id == '':
-                    skipped += 1
-                    continue
-                
-                customer_id = int(customer_id)
-                
-                # Check if loan already exists
-                if Loan.objects.filter(loan_id=loan_id).exists():
-                    skipped += 1
-                    continue
-                
-                # Get customer
-                try:
-                    customer = Customer.objects.get(customer_id=customer_id)
-                except Customer.DoesNotExist:
-                    self.stdout.write(self.style.WARNING(f"Customer {customer_id} not found for loan {loan_id}"))
-                    skipped += 1
-                    continue
-                
-                # Parse dates
-                start_date = row.get('start_date')
-                end_date = row.get('end_date')
-                
-                if pd.notna(start_date):
-                    if isinstance(start_date, str):
-                        start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-                    else:
-                        start_date = start_date.date() if hasattr(start_date, 'date') else start_date
-                else:
-                    start_date = timezone.now().date()
-                
-                if pd.notna(end_date):
-                    if isinstance(end_date, str):
-                        end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-                    else:
-                        end_date = end_date.date() if hasattr(end_date, 'date') else end_date
-                else:
-                    end_date = None
-                
-                loan = Loan.objects.create(
-                    loan_id=loan_id,
-                    customer=customer,
-                    loan_amount=float(row.get('loan_amount', 0)) if pd.notna(row.get('loan_amount')) else 0,
-                    tenure=int(row.get('tenure', 0)) if pd.notna(row.get('tenure')) else 0,
-                    interest_rate=float(row.get('interest_rate', 0)) if pd.notna(row.get('interest_rate')) else 0,
-                    monthly_repayment=float(row.get('monthly_repayment', 0) or row.get('emi', 0)) if pd.notna(row.get('monthly_repayment') or row.get('emi')) else 0,
-                    emis_paid_on_time=int(row.get('emis_paid_on_time', 0)) if pd.notna(row.get('emis_paid_on_time')) else 0,
-                    start_date=start_date,
-                    end_date=end_date,
-                )
-                created += 1
-            
+
+            # load existing loan and customer IDs once, then check rows against the sets
+            existing = set(Loan.objects.values_list('loan_id', flat=True))
+            customer_ids = set(Customer.objects.values_list('customer_id', flat=True))
+
+            columns, chunks = _read_xlsx_chunks(excel_path)
+            parse = partial(_parse_validate_loan_chunk, columns)
+            for i, (df, rows) in enumerate(_parallel_map(parse, chunks, self.workers)):
+                if i == 0:
+                    self.stdout.write(f"Mapped loan columns: {list(df.columns)}")
+
+                total_rows += rows
+                created += self.write_loan_chunk(df, existing, customer_ids)
+
+            skipped = total_rows - created
+
             self.stdout.write(self.style.SUCCESS(f'Created {created} loans, skipped {skipped} existing/invalid loans'))
-        
+
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'Error ingesting loans: {str(e)}'))
+
+    def write_loan_chunk(self, df, existing, customer_ids):
+        """
+        Insert one cleaned chunk of loans. Returns how many were created.
+        """
+        # skip loans we already have (and repeats within the file)
+        df = df[~df['loan_id'].isin(existing) & ~df['loan_id'].duplicated()]
+
+        missing = ~df['customer_id'].isin(customer_ids)
+        for row in df[missing].itertuples(index=False):
+            self.stdout.write(self.style.WARNING(f"Customer {row.customer_id} not found for loan {row.loan_id}"))
+        df = df[~missing]
+
+        loans = [
+            Loan(
+                loan_id=row.loan_id,
+                customer_id=row.customer_id,
+                loan_amount=row.loan_amount,
+                tenure=row.tenure,
+                interest_rate=row.interest_rate,
+                monthly_repayment=row.monthly_repayment,
+                emis_paid_on_time=row.emis_paid_on_time,
+                start_date=row.start_date,
+                end_date=row.end_date if pd.notna(row.end_date) else None,
+            )
+            for row in df.itertuples(index=False)
+        ]
+
+        self.bulk_insert(Loan, loans)
+        existing.update(df['loan_id'].tolist())
+
+        return len(loans)
@@ -0,0 +1,33 @@
+# Generated migration for core app
+
+from django.core.management.color import no_style
+from django.db import migrations, models
+
+
+def reset_id_sequences(apps, schema_editor):
+    # the new ID sequences start at 1, so move them past the rows we already have
+    id_models = [apps.get_model('core', 'Customer'), apps.get_model('core', 'Loan')]
+    connection = schema_editor.connection
+    for sql in connection.ops.sequence_reset_sql(no_style(), id_models):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_loan_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customer',
+            name='customer_id',
+            field=models.AutoField(primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='loan',
+            name='loan_id',
+            field=models.AutoField(primary_key=True, serialize=False),
+        ),
+        migrations.RunPython(reset_id_sequences, migrations.RunPython.noop),
+    ]
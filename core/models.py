@@ -4,8 +4,8 @@ from django.db import models
 from django.utils import timezone
 
 class Customer(models.Model):
-    # IntegerField so we can import existing customer IDs from Excel
-    customer_id = models.IntegerField(primary_key=True)
+    # the DB assigns new IDs; ingest still loads the existing IDs from Excel
+    customer_id = models.AutoField(primary_key=True)
     first_name = models.CharField(max_length=100)
     last_name = models.CharField(max_length=100)
     # can be null because Excel data doesn't have phone numbers
@@ -30,8 +30,8 @@ class Customer(models.Model):
 
 
 class Loan(models.Model):
-    # IntegerField to keep loan IDs from imported Excel data
-    loan_id = models.IntegerField(primary_key=True)
+    # the DB assigns new IDs; ingest still loads the existing IDs from Excel
+    loan_id = models.AutoField(primary_key=True)
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='loans')
     loan_amount = models.FloatField()
     tenure = models.IntegerField()  # months
@@ -46,6 +46,11 @@ class Loan(models.Model):
     class Meta:
         db_table = 'loans'
         ordering = ['loan_id']
+        # credit scoring filters a customer's loans by year and by EMIs paid
+        indexes = [
+            models.Index(fields=['customer', 'start_date'], name='loans_customer_start_idx'),
+            models.Index(fields=['customer', 'emis_paid_on_time'], name='loans_customer_emis_idx'),
+        ]
 
     def __str__(self):
         return f"Loan {self.loan_id} - Customer {self.customer.customer_id}"
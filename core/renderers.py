@@ -0,0 +1,26 @@
+"""
+JSON renderer backed by orjson.
+"""
+
+import orjson
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class ORJSONRenderer(BaseRenderer):
+    # drop-in for DRF's JSONRenderer; orjson builds the bytes a lot faster than stdlib json
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        option = orjson.OPT_NON_STR_KEYS
+        # the browsable API asks for indented output
+        if renderer_context and renderer_context.get('indent'):
+            option |= orjson.OPT_INDENT_2
+
+        # anything orjson doesn't know (Decimal, lazy strings, ...) goes through DRF's encoder
+        return orjson.dumps(data, default=JSONEncoder().default, option=option)
@@ -7,8 +7,6 @@ from .models import Customer, Loan
 
 
 class CustomerSerializer(serializers.ModelSerializer):
-    name = serializers.CharField(source='name', read_only=True)
-
     class Meta:
         model = Customer
         fields = [
@@ -35,6 +33,8 @@ class CustomerRegistrationSerializer(serializers.ModelSerializer):
             'age',
             'monthly_salary',
         ]
+        # the view relies on the DB unique constraint instead of an extra lookup
+        extra_kwargs = {'phone_number': {'validators': []}}
 
 
 class LoanSerializer(serializers.ModelSerializer):
@@ -89,8 +89,11 @@ class LoanDetailSerializer(serializers.ModelSerializer):
 
 
 class LoanListSerializer(serializers.ModelSerializer):
-    customer_id = serializers.SerializerMethodField()
-    repayments_left = serializers.IntegerField(read_only=True)
+    # read straight from the FK column so we never load the customer row
+    customer_id = serializers.IntegerField(read_only=True)
+    # annotated on the queryset by view_loans (Loan.repayments_left is a property,
+    # so the annotation can't use the same name)
+    repayments_left = serializers.IntegerField(source='remaining_repayments', read_only=True)
 
     class Meta:
         model = Loan
@@ -107,9 +110,6 @@ class LoanListSerializer(serializers.ModelSerializer):
             'repayments_left',
         ]
 
-    def get_customer_id(self, obj):
-        return obj.customer.customer_id
-
 
 class CheckEligibilitySerializer(serializers.Serializer):
     customer_id = serializers.IntegerField()
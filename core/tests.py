@@ -1,9 +1,293 @@
 """
-Empty tests file.
+Tests for the core app.
 """
 
-from django.test import TestCase
+import json
+from datetime import date
+from io import StringIO
+from unittest import mock
 
+import pandas as pd
 
-class CoreTestCase(TestCase):
-    pass
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from . import utils, views
+from .management.commands.ingest_data import (
+    Command as IngestCommand,
+    _clean_customer_chunk,
+    _clean_loan_chunk,
+    _parse_validate_customer_chunk,
+)
+from .models import Customer, Loan
+from .utils import (
+    calculate_credit_score,
+    calculate_emi,
+    calculate_emi_vec,
+    calculate_credit_score_bulk,
+    check_eligibility_cached,
+    create_loan_record,
+    get_customer_with_loan_stats,
+)
+
+
+def make_customer(**kwargs):
+    fields = {
+        'first_name': 'Test',
+        'last_name': 'User',
+        'age': 30,
+        'monthly_salary': 50000,
+        'approved_limit': 1800000,
+        'current_debt': 0,
+    }
+    fields.update(kwargs)
+    return Customer.objects.create(**fields)
+
+
+def make_loan(customer, **kwargs):
+    fields = {
+        'loan_amount': 100000,
+        'tenure': 12,
+        'interest_rate': 10.0,
+        'monthly_repayment': 8792.0,
+        'emis_paid_on_time': 12,
+        'start_date': date(2024, 3, 1),
+    }
+    fields.update(kwargs)
+    return Loan.objects.create(customer=customer, **fields)
+
+
+class EmiTests(SimpleTestCase):
+    def test_matches_closed_form_and_array_version(self):
+        # rates with more than two decimals are common (eighth-percent steps)
+        cases = [
+            (1000000, 10.125, 240),
+            (500000, 8.375, 120),
+            (250000, 0.001, 36),
+            (120000, 12.0, 12),
+            (120000, 0, 12),
+        ]
+        for principal, rate, tenure in cases:
+            with self.subTest(principal=principal, rate=rate, tenure=tenure):
+                r = rate / 1200
+                expected = principal * r * (1 + r) ** tenure / ((1 + r) ** tenure - 1) if r else principal / tenure
+                emi = calculate_emi(principal, rate, tenure)
+                self.assertAlmostEqual(emi, expected, places=2)
+                self.assertEqual(emi, calculate_emi_vec([principal], [rate], [tenure])[0])
+
+    def test_known_values(self):
+        self.assertEqual(calculate_emi(1000000, 10.125, 240), 9733.18)
+        self.assertEqual(calculate_emi(500000, 8.375, 120), 6165.91)
+
+
+class CreateLoanRecordTests(TestCase):
+    def test_inserts_loan_and_adds_to_debt(self):
+        customer = make_customer(current_debt=1000)
+
+        loan_id = create_loan_record(
+            customer,
+            loan_amount=200000,
+            tenure=12,
+            interest_rate=10.5,
+            monthly_repayment=17630.0,
+            start_date=date(2024, 1, 15),
+            end_date=date(2025, 1, 15),
+        )
+
+        loan = Loan.objects.get(loan_id=loan_id)
+        self.assertEqual(loan.customer_id, customer.customer_id)
+        self.assertEqual(loan.loan_amount, 200000)
+        self.assertEqual(loan.emis_paid_on_time, 0)
+        self.assertEqual(loan.end_date, date(2025, 1, 15))
+        customer.refresh_from_db()
+        self.assertEqual(customer.current_debt, 201000)
+
+
+class CreditScoreBulkTests(TestCase):
+    def test_matches_scalar_scores(self):
+        no_loans = make_customer()
+        over_limit = make_customer(approved_limit=100000, current_debt=200000)
+        make_loan(over_limit)
+        zero_salary = make_customer(monthly_salary=0)
+        make_loan(zero_salary)
+        general = make_customer(monthly_salary=20000)
+        make_loan(general)
+        make_loan(general, emis_paid_on_time=0, start_date=date(2022, 6, 1))
+        make_loan(general, loan_amount=300000)
+
+        bulk = calculate_credit_score_bulk(Customer.objects.all(), current_year=2024)
+
+        for customer in (no_loans, over_limit, zero_salary, general):
+            with self.subTest(customer=customer.customer_id):
+                self.assertEqual(
+                    bulk[customer.customer_id],
+                    calculate_credit_score(customer, current_year=2024),
+                )
+        self.assertEqual(bulk[no_loans.customer_id], 51)
+        self.assertEqual(bulk[over_limit.customer_id], 0)
+
+
+class EligibilityCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = make_customer()
+        make_loan(self.customer)
+        # read the fields back as the views see them
+        self.customer.refresh_from_db()
+        patcher = mock.patch.object(utils, 'check_eligibility', wraps=utils.check_eligibility)
+        self.check_eligibility = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_repeat_check_is_cached(self):
+        first = check_eligibility_cached(self.customer, 100000, 10.0, 12)
+        second = check_eligibility_cached(self.customer, 100000, 10.0, 12)
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.check_eligibility.call_count, 1)
+
+    def test_different_request_is_not_shared(self):
+        check_eligibility_cached(self.customer, 100000, 10.0, 12)
+        check_eligibility_cached(self.customer, 100000, 10.0, 24)
+
+        self.assertEqual(self.check_eligibility.call_count, 2)
+
+    def test_new_loan_invalidates(self):
+        check_eligibility_cached(self.customer, 100000, 10.0, 12)
+        make_loan(self.customer)
+        check_eligibility_cached(self.customer, 100000, 10.0, 12)
+
+        self.assertEqual(self.check_eligibility.call_count, 2)
+
+    def test_annotated_customer_uses_same_key(self):
+        check_eligibility_cached(self.customer, 100000, 10.0, 12)
+        annotated = get_customer_with_loan_stats(self.customer.customer_id, (
+            'customer_id', 'monthly_salary', 'approved_limit', 'current_debt',
+        ))
+        check_eligibility_cached(annotated, 100000, 10.0, 12)
+
+        self.assertEqual(self.check_eligibility.call_count, 1)
+
+
+class ViewLoansTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.customer = make_customer()
+        self.loans = [make_loan(self.customer, emis_paid_on_time=i) for i in range(5)]
+        self.url = reverse('view-loans', args=[self.customer.customer_id])
+
+    def expected(self):
+        return [
+            {'loan_id': loan.loan_id, 'repayments_left': loan.tenure - loan.emis_paid_on_time}
+            for loan in self.loans
+        ]
+
+    def summary(self, data):
+        return [{'loan_id': row['loan_id'], 'repayments_left': row['repayments_left']} for row in data]
+
+    def test_small_list_is_a_normal_response(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIsInstance(response, StreamingHttpResponse)
+        self.assertEqual(self.summary(response.json()), self.expected())
+
+    def test_large_list_is_streamed_in_batches(self):
+        with mock.patch.object(views, 'LOANS_CHUNK_SIZE', 2):
+            response = self.client.get(self.url)
+            chunks = list(response.streaming_content)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response, StreamingHttpResponse)
+        # 5 loans in batches of 2, plus the closing bracket
+        self.assertEqual(len(chunks), 4)
+        data = json.loads(b''.join(chunks))
+        self.assertEqual(self.summary(data), self.expected())
+        self.assertEqual(data[0]['customer_id'], self.customer.customer_id)
+
+    def test_browsable_api(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='text/html')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+
+    def test_unknown_customer(self):
+        response = self.client.get(reverse('view-loans', args=[self.customer.customer_id + 1]))
+
+        self.assertEqual(response.status_code, 404)
+
+
+class IngestCleaningTests(SimpleTestCase):
+    def test_customer_rows_with_bad_ids_are_skipped(self):
+        columns = ['Customer ID', 'First Name', 'Last Name', 'Age', 'Monthly Salary', 'Approved Limit']
+        rows = [
+            [1.0, 'Asha', 'Rao', 30.0, 50000.0, 1800000.0],
+            ['', 'No', 'Id', 40.0, 60000.0, 2200000.0],
+            [0.0, 'Zero', 'Id', 25.0, 30000.0, 1100000.0],
+            ['abc', 'Bad', 'Id', 35.0, 45000.0, 1600000.0],
+            ['7', 'Text', 'Id', 'n/a', 20000.0, 700000.0],
+        ]
+
+        df, counts = _parse_validate_customer_chunk(columns, rows)
+
+        self.assertEqual(counts, {'rows': 5, 'null': 2, 'zero': 1})
+        self.assertEqual(df['customer_id'].tolist(), [1, 7])
+        self.assertEqual(df['age'].tolist(), [30, 0])
+        self.assertEqual(df['first_name'].tolist(), ['Asha', 'Text'])
+
+    def test_loan_payment_falls_back_to_emi_then_terms(self):
+        df = pd.DataFrame({
+            'loan_id': [1, 2, 3, 4],
+            'customer_id': [1, 1, 1, 1],
+            'loan_amount': [120000, 120000, 120000, 120000],
+            'tenure': [12, 12, 12, 0],
+            'interest_rate': [0, 0, 0, 0],
+            'monthly_repayment': [None, 0.0, None, None],
+            'emi': [500.0, 900.0, None, None],
+        })
+
+        df, rows = _clean_loan_chunk(df)
+
+        self.assertEqual(rows, 4)
+        # blank -> emi column, an explicit 0 stays 0, otherwise worked out from
+        # the terms, and 0 when there are no terms to work from
+        self.assertEqual(df['monthly_repayment'].tolist(), [500.0, 0.0, 10000.0, 0.0])
+
+    def test_missing_approved_limit_comes_from_salary(self):
+        df = pd.DataFrame({
+            'customer_id': [1, 2],
+            'monthly_salary': [50000.0, 41700.0],
+            'approved_limit': [None, 999.0],
+        })
+
+        df, _ = _clean_customer_chunk(df)
+        self.assertEqual(df['approved_limit'].tolist(), [1800000.0, 999.0])
+
+        # a file without the column at all gets it for every row
+        df, _ = _clean_customer_chunk(pd.DataFrame({'customer_id': [3], 'monthly_salary': [41700.0]}))
+        self.assertEqual(df['approved_limit'].tolist(), [1500000.0])
+
+
+class IngestWriteTests(TestCase):
+    def test_repeated_phone_numbers_are_skipped_not_counted(self):
+        make_customer(phone_number='9000000001')
+        df, _ = _clean_customer_chunk(pd.DataFrame({
+            'customer_id': [101, 102, 103, 104],
+            'monthly_salary': [50000.0] * 4,
+            'phone_number': ['9000000001', '9000000002', '9000000002', None],
+        }))
+        existing = set(Customer.objects.values_list('customer_id', flat=True))
+        phones = {'9000000001'}
+        skipped_reasons = {'null': 0, 'zero': 0, 'duplicate': 0, 'phone': 0}
+        command = IngestCommand(stdout=StringIO())
+
+        created = command.write_customer_chunk(df, existing, phones, skipped_reasons)
+
+        self.assertEqual(created, 2)
+        self.assertEqual(skipped_reasons['phone'], 2)
+        self.assertEqual(
+            sorted(Customer.objects.filter(customer_id__gt=100).values_list('customer_id', flat=True)),
+            [102, 104],
+        )
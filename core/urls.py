@@ -7,9 +7,9 @@ from . import views
 
 # all the API endpoints
 urlpatterns = [
-    path('register/', views.register, name='register'),
-    path('check-eligibility/', views.check_eligibility, name='check-eligibility'),
-    path('create-loan/', views.create_loan, name='create-loan'),
-    path('view-loan/<int:loan_id>/', views.view_loan, name='view-loan'),
-    path('view-loans/<int:customer_id>/', views.view_loans, name='view-loans'),
+    path('register/', views.RegisterView.as_view(), name='register'),
+    path('check-eligibility/', views.CheckEligibilityView.as_view(), name='check-eligibility'),
+    path('create-loan/', views.CreateLoanView.as_view(), name='create-loan'),
+    path('view-loan/<int:loan_id>/', views.ViewLoanView.as_view(), name='view-loan'),
+    path('view-loans/<int:customer_id>/', views.ViewLoansView.as_view(), name='view-loans'),
 ]
@@ -3,8 +3,30 @@ Credit scoring and EMI calculation utilities.
 """
 
 from datetime import datetime, timedelta
-from .models import Loan
-from django.db.models import Sum, Count, Q
+from functools import lru_cache
+import numpy as np
+from .models import Customer, Loan
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F, Sum, Count, Max, Q
+from django.utils import timezone
+
+# borrowing up to 2 years of salary gets full marks for loan volume
+_SALARY_TO_CAP = 24.0
+
+# keys of the loan stats dict built by loan_stat_aggregates
+LOAN_STAT_KEYS = ('total_loans', 'on_time_loans', 'current_year_loans', 'total_volume', 'total_emi')
+
+
+@lru_cache(maxsize=8192)
+def _emi(principal, monthly_rate, n):
+    # keyed on the exact inputs, so a cached EMI is always the one the formula gives
+    r = monthly_rate / 100 / 12
+    if r == 0:
+        return principal / n
+    # (1+r)^n is the expensive part, so only work it out once
+    pw = (1 + r) ** n
+    return round(principal * (r * pw / (pw - 1)), 2)
 
 
 def calculate_emi(principal, monthly_rate, tenure_months):
@@ -14,20 +36,61 @@ def calculate_emi(principal, monthly_rate, tenure_months):
     if monthly_rate == 0:
         return principal / tenure_months
     
-    r = monthly_rate / 100 / 12
-    n = tenure_months
-    
-    if r == 0:
-        return principal / n
-    
-    numerator = r * ((1 + r) ** n)
-    denominator = ((1 + r) ** n) - 1
+    # repeated requests with the same terms come from the cache
+    return _emi(principal, monthly_rate, tenure_months)
+
+
+def calculate_emi_vec(principal, monthly_rate, tenure_months):
+    """
+    Array version of calculate_emi, for working out EMIs for many loans in one go.
+    """
+    principal = np.asarray(principal, dtype=np.float64)
+    r = np.asarray(monthly_rate, dtype=np.float64) / 100 / 12
+    n = np.asarray(tenure_months, dtype=np.float64)
     
-    emi = principal * (numerator / denominator)
-    return round(emi, 2)
+    pw = np.power(1.0 + r, n)
+    # zero-rate loans are just split evenly, same as calculate_emi
+    with np.errstate(divide='ignore', invalid='ignore'):
+        emi = np.where(r == 0, principal / n, principal * (r * pw / (pw - 1.0)))
+    return np.round(emi, 2)
+
+
+def loan_stat_aggregates(current_year, prefix=''):
+    # the per-customer loan numbers used by scoring and eligibility;
+    # prefix='loans__' builds the same numbers as annotations on a Customer query
+    return {
+        'total_loans': Count(f'{prefix}loan_id'),
+        'on_time_loans': Count(f'{prefix}loan_id', filter=Q(**{f'{prefix}emis_paid_on_time__gte': 1})),
+        'current_year_loans': Count(f'{prefix}loan_id', filter=Q(**{f'{prefix}start_date__year': current_year})),
+        'total_volume': Sum(f'{prefix}loan_amount'),
+        'total_emi': Sum(f'{prefix}monthly_repayment'),
+    }
 
 
-def calculate_credit_score(customer):
+def get_customer_with_loan_stats(customer_id, fields):
+    """
+    Fetch a customer (only `fields`) with their loan stats and the time of their
+    latest loan change annotated on, all in one query. None if there's no such customer.
+    """
+    current_year = datetime.now().year
+    return (
+        Customer.objects.only(*fields)
+        .annotate(
+            **loan_stat_aggregates(current_year, prefix='loans__'),
+            loans_updated_at=Max('loans__updated_at'),
+        )
+        .filter(customer_id=customer_id)
+        .first()
+    )
+
+
+def get_loan_stats(customer, *, current_year=None):
+    # everything scoring and eligibility need from the loan history, in one query
+    current_year = current_year or datetime.now().year
+    return Loan.objects.filter(customer=customer).aggregate(**loan_stat_aggregates(current_year))
+
+
+def calculate_credit_score(customer, loan_stats=None, *, current_year=None):
     # your score is 0-100 based on:
     # 1. did you pay EMIs on time (30%)
     # 2. how many loans you took (20%)
@@ -39,21 +102,20 @@ def calculate_credit_score(customer):
     if customer.current_debt > customer.approved_limit:
         return 0
     
-    # Get all loans for customer
-    all_loans = Loan.objects.filter(customer=customer)
+    # Get loan history stats for customer
+    if loan_stats is None:
+        loan_stats = get_loan_stats(customer, current_year=current_year)
     
-    if not all_loans.exists():
+    total_loans = loan_stats['total_loans']
+    if total_loans == 0:
         # New customer - give base score (51 to pass > 50 threshold)
         return 51
     
     score = 0
     
     # 1. Past loans paid on time (30 points max)
-    total_loans = all_loans.count()
-    if total_loans > 0:
-        on_time_loans = all_loans.filter(emis_paid_on_time__gte=1).count()
-        on_time_ratio = on_time_loans / total_loans
-        score += on_time_ratio * 30
+    on_time_ratio = loan_stats['on_time_loans'] / total_loans
+    score += on_time_ratio * 30
     
     # 2. Number of loans taken (20 points max)
     # More loans = more experience
@@ -61,37 +123,91 @@ def calculate_credit_score(customer):
     score += loan_count_score
     
     # 3. Loan activity in current year (20 points max)
-    current_year = datetime.now().year
-    current_year_loans = all_loans.filter(start_date__year=current_year).count()
+    current_year_loans = loan_stats['current_year_loans']
     recent_activity_score = min(current_year_loans / 3, 1.0) * 20  # Max at 3+ loans in year
     score += recent_activity_score
     
     # 4. Loan approved volume (30 points max)
-    total_volume = all_loans.aggregate(Sum('loan_amount'))['loan_amount__sum'] or 0
-    salary_years = customer.monthly_salary * 12
-    volume_ratio = total_volume / (salary_years * 2) if salary_years > 0 else 0
+    total_volume = loan_stats['total_volume'] or 0
+    salary_cap = customer.monthly_salary * _SALARY_TO_CAP
+    volume_ratio = total_volume / salary_cap if salary_cap > 0 else 0
     volume_score = min(volume_ratio, 1.0) * 30
     score += volume_score
     
     return min(round(score, 2), 100)
 
 
-def check_eligibility(customer, loan_amount, interest_rate, tenure):
+def calculate_credit_score_bulk(customer_qs, *, current_year=None):
+    """
+    Credit scores for a whole queryset of customers, keyed by customer_id.
+    
+    Same rules as calculate_credit_score, but the loan stats for every customer
+    come from one GROUP BY query and the scores are worked out with NumPy.
+    """
+    customers = list(customer_qs.values_list('customer_id', 'monthly_salary', 'approved_limit', 'current_debt'))
+    if not customers:
+        return {}
+    
+    current_year = current_year or datetime.now().year
+    stats = {
+        row['customer_id']: row
+        for row in Loan.objects.filter(customer__in=customer_qs.values('customer_id'))
+        .values('customer_id')
+        .annotate(**loan_stat_aggregates(current_year))
+        .order_by()
+    }
+    
+    def column(key):
+        return np.array([(stats.get(c[0]) or {}).get(key) or 0 for c in customers], dtype=np.float64)
+    
+    customer_ids = [c[0] for c in customers]
+    salary = np.array([c[1] for c in customers], dtype=np.float64)
+    approved_limit = np.array([c[2] for c in customers], dtype=np.float64)
+    current_debt = np.array([c[3] for c in customers], dtype=np.float64)
+    total_loans = column('total_loans')
+    on_time_loans = column('on_time_loans')
+    current_year_loans = column('current_year_loans')
+    total_volume = column('total_volume')
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        on_time_ratio = np.where(total_loans > 0, on_time_loans / total_loans, 0.0)
+        volume_ratio = np.where(salary > 0, total_volume / (salary * _SALARY_TO_CAP), 0.0)
+    
+    score = (
+        on_time_ratio * 30
+        + np.minimum(total_loans / 5, 1.0) * 20
+        + np.minimum(current_year_loans / 3, 1.0) * 20
+        + np.minimum(volume_ratio, 1.0) * 30
+    )
+    score = np.minimum(np.round(score, 2), 100)
+    # new customers get the base score, and anyone over their limit gets 0
+    score = np.where(total_loans == 0, 51, score)
+    score = np.where(current_debt > approved_limit, 0, score)
+    
+    return dict(zip(customer_ids, score.tolist()))
+
+
+def check_eligibility(customer, loan_amount, interest_rate, tenure, loan_stats=None):
     """
     Check loan eligibility based on credit score and other factors.
     
+    loan_stats is the dict from get_loan_stats; it's fetched here if not given.
+    
     Returns:
         dict with approval status and corrected interest rate
     """
+    # one query for the loan history, shared by scoring and the EMI check
+    if loan_stats is None:
+        loan_stats = get_loan_stats(customer)
+    
     # Calculate credit score
-    credit_score = calculate_credit_score(customer)
+    credit_score = calculate_credit_score(customer, loan_stats)
     
     # Calculate monthly EMI
     emi = calculate_emi(loan_amount, interest_rate, tenure)
     
     # Calculate sum of current EMIs
-    current_loans = Loan.objects.filter(customer=customer)
-    total_current_emi = current_loans.aggregate(Sum('monthly_repayment'))['monthly_repayment__sum'] or 0
+    total_current_emi = loan_stats['total_emi'] or 0
     total_emi_with_new = total_current_emi + emi
     
     # Decision logic
@@ -135,8 +251,116 @@ def check_eligibility(customer, loan_amount, interest_rate, tenure):
     }
 
 
+def check_eligibility_cached(customer, loan_amount, interest_rate, tenure, timeout=60):
+    """
+    check_eligibility, cached for `timeout` seconds.
+    
+    The key includes the customer's eligibility fields and the time of their
+    latest loan change, so a new or updated loan always gets a fresh result.
+    A customer from get_customer_with_loan_stats already carries both the
+    version and the loan stats, so no further queries are needed.
+    """
+    loan_stats = None
+    if hasattr(customer, 'loans_updated_at'):
+        version = customer.loans_updated_at
+        loan_stats = {key: getattr(customer, key) for key in LOAN_STAT_KEYS}
+    else:
+        version = Loan.objects.filter(customer=customer).aggregate(Max('updated_at'))['updated_at__max']
+    key = ':'.join(str(part) for part in (
+        'elig',
+        customer.customer_id,
+        customer.monthly_salary,
+        customer.approved_limit,
+        customer.current_debt,
+        version.isoformat() if version else 'none',
+        loan_amount,
+        interest_rate,
+        tenure,
+    ))
+    return cache.get_or_set(
+        key,
+        lambda: check_eligibility(customer, loan_amount, interest_rate, tenure, loan_stats),
+        timeout,
+    )
+
+
+@lru_cache(maxsize=None)
+def _create_loan_sql():
+    # table and column names come from the models, so the statement follows
+    # any schema change instead of silently drifting from it
+    qn = connection.ops.quote_name
+    
+    def column(model, name):
+        return qn(model._meta.get_field(name).column)
+    
+    loans = qn(Loan._meta.db_table)
+    customers = qn(Customer._meta.db_table)
+    loan_fields = (
+        'customer', 'loan_amount', 'tenure', 'interest_rate', 'monthly_repayment',
+        'emis_paid_on_time', 'start_date', 'end_date', 'created_at', 'updated_at',
+    )
+    placeholders = ['0' if name == 'emis_paid_on_time' else '%s' for name in loan_fields]
+    loan_id = column(Loan, 'loan_id')
+    loan_customer = column(Loan, 'customer')
+    loan_amount = column(Loan, 'loan_amount')
+    customer_id = column(Customer, 'customer_id')
+    current_debt = column(Customer, 'current_debt')
+    
+    return f"""
+        WITH new_loan AS (
+            INSERT INTO {loans} ({', '.join(column(Loan, name) for name in loan_fields)})
+            VALUES ({', '.join(placeholders)})
+            RETURNING {loan_id}, {loan_customer}, {loan_amount}
+        )
+        UPDATE {customers}
+        SET {current_debt} = {customers}.{current_debt} + new_loan.{loan_amount}
+        FROM new_loan
+        WHERE {customers}.{customer_id} = new_loan.{loan_customer}
+        RETURNING new_loan.{loan_id}
+    """
+
+
+def create_loan_record(customer, loan_amount, tenure, interest_rate, monthly_repayment, start_date, end_date):
+    """
+    Insert an approved loan and add its amount to the customer's current_debt.
+    
+    On Postgres both writes go in one statement (one round trip); other databases
+    use two queries in a transaction. Returns the new loan_id.
+    """
+    if connection.vendor == 'postgresql':
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                _create_loan_sql(),
+                [
+                    customer.pk, loan_amount, tenure, interest_rate, monthly_repayment,
+                    start_date, end_date, now, now,
+                ],
+            )
+            return cursor.fetchone()[0]
+    
+    with transaction.atomic():
+        loan = Loan.objects.create(
+            customer=customer,
+            loan_amount=loan_amount,
+            tenure=tenure,
+            interest_rate=interest_rate,
+            monthly_repayment=monthly_repayment,
+            emis_paid_on_time=0,
+            start_date=start_date,
+            end_date=end_date,
+        )
+        # update in the DB so concurrent loans can't overwrite each other
+        Customer.objects.filter(pk=customer.pk).update(current_debt=F('current_debt') + loan_amount)
+    return loan.loan_id
+
+
 def round_to_nearest_lakh(amount):
     """
     Round amount to nearest lakh (100,000).
+    
+    Works on a single number or on a NumPy array / pandas Series in one call.
     """
-    return round(amount / 100000) * 100000
+    if np.isscalar(amount):
+        return round(amount / 100000) * 100000
+    return np.round(np.asarray(amount, dtype=np.float64) / 100000) * 100000
@@ -1,238 +1,289 @@
 # all the APIs for the system
 
+from itertools import islice
+
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.generics import GenericAPIView
 from rest_framework.response import Response
-from django.shortcuts import get_object_or_404
-from django.db.models import Sum, Max
-from datetime import datetime, timedelta
+from django.db import IntegrityError, transaction
+from django.http import StreamingHttpResponse
+from django.db.models import F
+from django.utils import timezone
+from dateutil.relativedelta import relativedelta
 
 from .models import Customer, Loan
+from .renderers import ORJSONRenderer
 from .serializers import (
-    CustomerSerializer,
     CustomerRegistrationSerializer,
     CheckEligibilitySerializer,
-    CheckEligibilityResponseSerializer,
     CreateLoanSerializer,
-    CreateLoanResponseSerializer,
     LoanDetailSerializer,
     LoanListSerializer,
 )
 from .utils import (
     calculate_emi,
-    calculate_credit_score,
-    check_eligibility as check_eligibility_util,
+    check_eligibility_cached,
+    create_loan_record,
+    get_customer_with_loan_stats,
     round_to_nearest_lakh,
 )
 
+# the customer columns eligibility checks actually read
+ELIGIBILITY_FIELDS = ('customer_id', 'monthly_salary', 'approved_limit', 'current_debt')
+
+# how many loans view_loans reads (and writes out) at a time
+LOANS_CHUNK_SIZE = 2000
+
+
+def _is_duplicate_phone(error):
+    # Postgres reports which constraint failed; other databases only put
+    # the column name in the message
+    diag = getattr(error.__cause__, 'diag', None)
+    name = getattr(diag, 'constraint_name', None) or str(error)
+    return 'phone_number' in name
+
 
-@api_view(['POST'])
-def register(request):
-    # when someone wants to register as a customer
-    # we auto-generate their customer ID and calculate how much they can borrow
-    serializer = CustomerRegistrationSerializer(data=request.data)
-    
-    if serializer.is_valid():
-        # Extract data
-        first_name = serializer.validated_data['first_name']
-        last_name = serializer.validated_data['last_name']
-        phone_number = serializer.validated_data['phone_number']
-        age = serializer.validated_data['age']
-        monthly_salary = serializer.validated_data['monthly_salary']
+class RegisterView(GenericAPIView):
+    serializer_class = CustomerRegistrationSerializer
+
+    def post(self, request):
+        # when someone wants to register as a customer
+        # we auto-generate their customer ID and calculate how much they can borrow
+        serializer = self.get_serializer(data=request.data)
         
-        # check if already registered with this phone number
-        if Customer.objects.filter(phone_number=phone_number).exists():
-            return Response(
-                {'error': 'Customer with this phone number already exists.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        if serializer.is_valid():
+            # Extract data
+            first_name = serializer.validated_data['first_name']
+            last_name = serializer.validated_data['last_name']
+            phone_number = serializer.validated_data['phone_number']
+            age = serializer.validated_data['age']
+            monthly_salary = serializer.validated_data['monthly_salary']
+            
+            # 36 times salary, rounded to nearest 100,000
+            approved_limit = round_to_nearest_lakh(36 * monthly_salary)
+            
+            # Create customer (the DB assigns the customer ID)
+            # the unique constraint on phone_number catches repeat registrations
+            try:
+                with transaction.atomic():
+                    customer = Customer.objects.create(
+                        first_name=first_name,
+                        last_name=last_name,
+                        phone_number=phone_number,
+                        age=age,
+                        monthly_salary=monthly_salary,
+                        approved_limit=approved_limit,
+                        current_debt=0
+                    )
+            except IntegrityError as e:
+                # anything other than a repeated phone number is a real error
+                if not _is_duplicate_phone(e):
+                    raise
+                return Response(
+                    {'error': 'Customer with this phone number already exists.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            # Return response
+            response_data = {
+                'customer_id': customer.customer_id,
+                'name': f"{customer.first_name} {customer.last_name}",
+                'age': customer.age,
+                'monthly_income': customer.monthly_salary,
+                'approved_limit': customer.approved_limit,
+                'phone_number': customer.phone_number,
+            }
+            
+            return Response(response_data, status=status.HTTP_201_CREATED)
         
-        # find the highest customer ID and add 1
-        max_customer_id = Customer.objects.aggregate(Max('customer_id'))['customer_id__max'] or 0
-        new_customer_id = max_customer_id + 1
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class CheckEligibilityView(GenericAPIView):
+    serializer_class = CheckEligibilitySerializer
+
+    def post(self, request):
+        # check if someone can get a loan and what interest rate they should get
+        serializer = self.get_serializer(data=request.data)
         
-        # 36 times salary, rounded to nearest 100,000
-        approved_limit = round_to_nearest_lakh(36 * monthly_salary)
+        if serializer.is_valid():
+            customer_id = serializer.validated_data['customer_id']
+            loan_amount = serializer.validated_data['loan_amount']
+            interest_rate = serializer.validated_data['interest_rate']
+            tenure = serializer.validated_data['tenure']
+            
+            # Get customer (eligibility only reads these columns) with their
+            # loan stats in the same query
+            customer = get_customer_with_loan_stats(customer_id, ELIGIBILITY_FIELDS)
+            if customer is None:
+                return Response(
+                    {'error': 'Customer not found.'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            
+            # Check eligibility (repeat checks within a minute come from the cache)
+            result = check_eligibility_cached(customer, loan_amount, interest_rate, tenure)
+            
+            # Calculate EMI with corrected rate if needed
+            if result['approval']:
+                final_rate = interest_rate
+            else:
+                final_rate = result['corrected_interest_rate']
+            
+            emi = calculate_emi(loan_amount, final_rate, tenure)
+            
+            response_data = {
+                'customer_id': customer_id,
+                'approval': result['approval'],
+                'interest_rate': interest_rate,
+                'corrected_interest_rate': result['corrected_interest_rate'],
+                'tenure': tenure,
+                'monthly_installment': emi,
+            }
+            
+            return Response(response_data, status=status.HTTP_200_OK)
         
-        # Create customer
-        customer = Customer.objects.create(
-            customer_id=new_customer_id,
-            first_name=first_name,
-            last_name=last_name,
-            phone_number=phone_number,
-            age=age,
-            monthly_salary=monthly_salary,
-            approved_limit=approved_limit,
-            current_debt=0
-        )
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class CreateLoanView(GenericAPIView):
+    serializer_class = CreateLoanSerializer
+
+    def post(self, request):
+        # make a new loan if the person is eligible
+        serializer = self.get_serializer(data=request.data)
         
-        # Return response
-        response_data = {
-            'customer_id': customer.customer_id,
-            'name': f"{customer.first_name} {customer.last_name}",
-            'age': customer.age,
-            'monthly_income': customer.monthly_salary,
-            'approved_limit': customer.approved_limit,
-            'phone_number': customer.phone_number,
-        }
+        if serializer.is_valid():
+            customer_id = serializer.validated_data['customer_id']
+            loan_amount = serializer.validated_data['loan_amount']
+            interest_rate = serializer.validated_data['interest_rate']
+            tenure = serializer.validated_data['tenure']
+            
+            # Get customer (eligibility only reads these columns) with their
+            # loan stats in the same query
+            customer = get_customer_with_loan_stats(customer_id, ELIGIBILITY_FIELDS)
+            if customer is None:
+                return Response(
+                    {'error': 'Customer not found.'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            
+            # Check eligibility (repeat checks within a minute come from the cache)
+            result = check_eligibility_cached(customer, loan_amount, interest_rate, tenure)
+            
+            if result['approval']:
+                # Use corrected rate if different
+                final_rate = interest_rate if interest_rate > result['corrected_interest_rate'] else result['corrected_interest_rate']
+                
+                # Calculate EMI
+                emi = calculate_emi(loan_amount, final_rate, tenure)
+                
+                # read the clock once so start and end dates agree; localdate()
+                # gives today's date in the configured TIME_ZONE
+                today = timezone.localdate()
+                
+                # Create loan (the DB assigns the loan ID) and add it to the
+                # customer's debt in the same round trip
+                loan_id = create_loan_record(
+                    customer,
+                    loan_amount=loan_amount,
+                    tenure=tenure,
+                    interest_rate=final_rate,
+                    monthly_repayment=emi,
+                    start_date=today,
+                    end_date=today + relativedelta(months=tenure)
+                )
+                
+                response_data = {
+                    'loan_id': loan_id,
+                    'customer_id': customer_id,
+                    'loan_approved': True,
+                    'message': 'Loan approved successfully.',
+                    'monthly_installment': emi,
+                }
+                
+                return Response(response_data, status=status.HTTP_201_CREATED)
+            else:
+                emi = calculate_emi(loan_amount, result['corrected_interest_rate'], tenure)
+                
+                response_data = {
+                    'loan_id': None,
+                    'customer_id': customer_id,
+                    'loan_approved': False,
+                    'message': 'Loan request rejected.',
+                    'monthly_installment': emi,
+                }
+                
+                return Response(response_data, status=status.HTTP_400_BAD_REQUEST)
         
-        return Response(response_data, status=status.HTTP_201_CREATED)
-    
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-
-@api_view(['POST'])
-def check_eligibility(request):
-    # check if someone can get a loan and what interest rate they should get
-    serializer = CheckEligibilitySerializer(data=request.data)
-    
-    if serializer.is_valid():
-        customer_id = serializer.validated_data['customer_id']
-        loan_amount = serializer.validated_data['loan_amount']
-        interest_rate = serializer.validated_data['interest_rate']
-        tenure = serializer.validated_data['tenure']
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ViewLoanView(GenericAPIView):
+    serializer_class = LoanDetailSerializer
+
+    def get(self, request, loan_id):
+        """
+        View loan details along with customer information.
+        """
+        # the detail serializer reads the customer, so fetch it in the same query
+        loan = Loan.objects.select_related('customer').filter(loan_id=loan_id).first()
+        if loan is None:
+            return Response(
+                {'error': 'Loan not found.'},
+                status=status.HTTP_404_NOT_FOUND
+            )
         
-        # Get customer
-        try:
-            customer = Customer.objects.get(customer_id=customer_id)
-        except Customer.DoesNotExist:
+        serializer = self.get_serializer(loan)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class ViewLoansView(GenericAPIView):
+    serializer_class = LoanListSerializer
+
+    def get_queryset(self):
+        # let the DB work out repayments left for every row
+        return Loan.objects.filter(customer_id=self.kwargs['customer_id']).annotate(
+            remaining_repayments=F('tenure') - F('emis_paid_on_time')
+        )
+
+    def get(self, request, customer_id):
+        """
+        View all loans of a customer with repayments_left calculated.
+        """
+        # only need to know the customer exists, not load the row
+        if not Customer.objects.filter(customer_id=customer_id).exists():
             return Response(
                 {'error': 'Customer not found.'},
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        # Check eligibility
-        result = check_eligibility_util(customer, loan_amount, interest_rate, tenure)
+        loans = self.get_queryset()
         
-        # Calculate EMI with corrected rate if needed
-        if result['approval']:
-            final_rate = interest_rate
-        else:
-            final_rate = result['corrected_interest_rate']
+        # read from a server-side cursor so a customer with thousands of loans
+        # never has to fit in memory all at once
+        rows = loans.iterator(chunk_size=LOANS_CHUNK_SIZE)
+        first = list(islice(rows, LOANS_CHUNK_SIZE))
         
-        emi = calculate_emi(loan_amount, final_rate, tenure)
+        # most customers fit in one batch, so they get a normal DRF response
+        # with content negotiation and exception handling
+        if len(first) < LOANS_CHUNK_SIZE:
+            serializer = self.get_serializer(first, many=True)
+            return Response(serializer.data, status=status.HTTP_200_OK)
         
-        response_data = {
-            'customer_id': customer_id,
-            'approval': result['approval'],
-            'interest_rate': interest_rate,
-            'corrected_interest_rate': result['corrected_interest_rate'],
-            'tenure': tenure,
-            'monthly_installment': emi,
-        }
+        # bigger lists are streamed one batch per write. the trade-off: this skips
+        # DRF's renderer negotiation, and the 200 is already sent, so a DB error
+        # part way through ends in truncated JSON rather than an error response
+        serializer = self.get_serializer()
+        renderer = ORJSONRenderer()
         
-        return Response(response_data, status=status.HTTP_200_OK)
-    
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-
-@api_view(['POST'])
-def create_loan(request):
-    # make a new loan if the person is eligible
-    serializer = CreateLoanSerializer(data=request.data)
-    
-    if serializer.is_valid():
-        customer_id = serializer.validated_data['customer_id']
-        loan_amount = serializer.validated_data['loan_amount']
-        interest_rate = serializer.validated_data['interest_rate']
-        tenure = serializer.validated_data['tenure']
+        def render_batch(batch):
+            return b','.join(renderer.render(serializer.to_representation(loan)) for loan in batch)
         
-        # Get customer
-        try:
-            customer = Customer.objects.get(customer_id=customer_id)
-        except Customer.DoesNotExist:
-            return Response(
-                {'error': 'Customer not found.'},
-                status=status.HTTP_404_NOT_FOUND
-            )
+        def render():
+            yield b'[' + render_batch(first)
+            while batch := list(islice(rows, LOANS_CHUNK_SIZE)):
+                yield b',' + render_batch(batch)
+            yield b']'
         
-        # Check eligibility
-        result = check_eligibility_util(customer, loan_amount, interest_rate, tenure)
-        
-        if result['approval']:
-            # Use corrected rate if different
-            final_rate = interest_rate if interest_rate > result['corrected_interest_rate'] else result['corrected_interest_rate']
-            
-            # Calculate EMI
-            emi = calculate_emi(loan_amount, final_rate, tenure)
-            
-            # Auto-generate loan_id (max + 1)
-            max_loan_id = Loan.objects.aggregate(Max('loan_id'))['loan_id__max'] or 0
-            new_loan_id = max_loan_id + 1
-            
-            # Create loan
-            loan = Loan.objects.create(
-                loan_id=new_loan_id,
-                customer=customer,
-                loan_amount=loan_amount,
-                tenure=tenure,
-                interest_rate=final_rate,
-                monthly_repayment=emi,
-                emis_paid_on_time=0,
-                start_date=datetime.now().date(),
-                end_date=(datetime.now() + timedelta(days=tenure*30)).date()
-            )
-            
-            # Update customer current_debt
-            customer.current_debt += loan_amount
-            customer.save()
-            
-            response_data = {
-                'loan_id': loan.loan_id,
-                'customer_id': customer_id,
-                'loan_approved': True,
-                'message': 'Loan approved successfully.',
-                'monthly_installment': emi,
-            }
-            
-            return Response(response_data, status=status.HTTP_201_CREATED)
-        else:
-            emi = calculate_emi(loan_amount, result['corrected_interest_rate'], tenure)
-            
-            response_data = {
-                'loan_id': None,
-                'customer_id': customer_id,
-                'loan_approved': False,
-                'message': 'Loan request rejected.',
-                'monthly_installment': emi,
-            }
-            
-            return Response(response_data, status=status.HTTP_400_BAD_REQUEST)
-    
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-
-@api_view(['GET'])
-def view_loan(request, loan_id):
-    """
-    View loan details along with customer information.
-    """
-    try:
-        loan = Loan.objects.get(loan_id=loan_id)
-    except Loan.DoesNotExist:
-        return Response(
-            {'error': 'Loan not found.'},
-            status=status.HTTP_404_NOT_FOUND
-        )
-    
-    serializer = LoanDetailSerializer(loan)
-    return Response(serializer.data, status=status.HTTP_200_OK)
-
-
-@api_view(['GET'])
-def view_loans(request, customer_id):
-    """
-    View all loans of a customer with repayments_left calculated.
-    """
-    try:
-        customer = Customer.objects.get(customer_id=customer_id)
-    except Customer.DoesNotExist:
-        return Response(
-            {'error': 'Customer not found.'},
-            status=status.HTTP_404_NOT_FOUND
-        )
-    
-    loans = Loan.objects.filter(customer=customer)
-    serializer = LoanListSerializer(loans, many=True)
-    
-    return Response(serializer.data, status=status.HTTP_200_OK)
+        return StreamingHttpResponse(render(), content_type='application/json', status=status.HTTP_200_OK)